@@ -1,12 +1,22 @@
 # You do not have to necessarily install those packages locally
 # The packages will be installed within the containers on start-up
 # (Compare the contents of Dockerfile and their handling of the requirements.txt)
+import concurrent.futures
+import csv
+import io
 import os
+import queue
+import threading
+import time
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 import dash
-from dash import dcc, html
+from dash import dcc, html, Input, Output
 import plotly.express as px
 import sys
 
@@ -25,210 +35,413 @@ SENSOR_DATA_API_URL_FORMAT = (
     "https://api.opensensemap.org/boxes/{sensebox_id}/data/{sensor_id}"
 )
 
-print("--- Starting Initial Data Load ---")
-conn_insert = None
-try:
-    conn_insert = psycopg2.connect(DATABASE_URL)  # connect to timescaledb
-    cursor_insert = conn_insert.cursor()
+# Box metadata changes rarely; cache the raw response on disk so container
+# restarts skip the external round-trip and short API outages don't take
+# the whole startup down
+META_CACHE_PATH = f"/tmp/meta_{SENSEBOX_ID}.json"
+META_CACHE_TTL_SECONDS = 3600
 
-    # 1. Fetch Metadata
-    print(f"Fetching metadata for SenseBox ID: {SENSEBOX_ID}")
-    meta_response = requests.get(METADATA_API_URL, timeout=30)
-    meta_response.raise_for_status()  # Exit on bad status (4xx, 5xx)
-    metadata = meta_response.json()
+# Set by the bootstrap thread once ingest and graph building are finished;
+# until then the app serves a "Loading..." placeholder
+READY = False
+graphs = []
 
-    if not metadata or "sensors" not in metadata:
-        print(
-            "Error: Could not retrieve valid metadata or no sensors found.",
-            file=sys.stderr,
-        )
-        sys.exit(1)
-
-    # Store sensor metadata (type, unit, icon) by sensor_id
-    sensor_details = {
-        s["_id"]: {"type": s.get("sensorType", "unknown"), "unit": s.get("unit", "")}
-        for s in metadata["sensors"]
-        if "_id" in s
-    }
-
-    # 2. Fetch and Insert Data for Each Sensor
-    for sensor_id, details in sensor_details.items():
-        print(f"Fetching data for Sensor ID: {sensor_id} (Type: {details['type']})")
-        data_url = SENSOR_DATA_API_URL_FORMAT.format(
-            sensebox_id=SENSEBOX_ID,
-            sensor_id=sensor_id,
-        )
 
-        try:
-            data_response = requests.get(data_url, timeout=60)
-            data_response.raise_for_status()
-            sensor_data = data_response.json()
-
-            if sensor_data:  # Check if list is not empty
-                # Prepare data for insertion
-                data_to_insert = []
-                for item in sensor_data:
-                    # Basic check for essential fields
-                    if "createdAt" in item and "value" in item:
-                        try:
-                            # Ensure measurement is float, handle potential None or errors
-                            measurement_val = (
-                                float(item["value"])
-                                if item["value"] is not None
-                                else None
-                            )
-                            data_to_insert.append(
-                                (
-                                    item["createdAt"],  # timestamp (TIMESTAMPTZ)
-                                    SENSEBOX_ID,  # box_id (TEXT)
-                                    sensor_id,  # sensor_id (TEXT)
-                                    measurement_val,  # measurement (DOUBLE PRECISION)
-                                    details["unit"],  # unit (TEXT)
-                                    details["type"],  # sensor_type (TEXT)
-                                )
-                            )
-                        except (ValueError, TypeError):
-                            print(
-                                f"Warning: Could not convert value '{item['value']}' to float"
-                                f"for sensor {sensor_id} at {item['createdAt']}. Skipping point.",
-                                file=sys.stderr,
-                            )
-
-                if data_to_insert:
-                    # Insert data, ignoring conflicts (based on UNIQUE constraint in init.sql)
-                    insert_query = """
-                        INSERT INTO sensor_data (timestamp, box_id, sensor_id, measurement, unit, sensor_type)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (timestamp, box_id, sensor_id) DO NOTHING;
-                    """
-                    cursor_insert.executemany(insert_query, data_to_insert)
-                    conn_insert.commit()  # Commit after each sensor's data is processed
-                    print(
-                        f"Inserted {len(data_to_insert)} records for sensor {sensor_id}."
-                    )
-                else:
-                    print(
-                        f"No valid data points found to insert for sensor {sensor_id}."
-                    )
-            else:
-                print(f"No data returned from API for sensor {sensor_id}.")
+def load_metadata():
+    """Return box metadata, preferring a sufficiently fresh disk cache."""
+    try:
+        if time.time() - os.path.getmtime(META_CACHE_PATH) < META_CACHE_TTL_SECONDS:
+            print(f"Using cached metadata from {META_CACHE_PATH}")
+            with open(META_CACHE_PATH, "rb") as cache_file:
+                return orjson.loads(cache_file.read())
+    except OSError:
+        pass  # No cache yet (or unreadable); fall through to the API
 
-        except requests.exceptions.RequestException as e:
+    print(f"Fetching metadata for SenseBox ID: {SENSEBOX_ID}")
+    try:
+        meta_response = requests.get(METADATA_API_URL, timeout=30)
+        meta_response.raise_for_status()  # Raise on bad status (4xx, 5xx)
+    except requests.exceptions.RequestException:
+        if os.path.exists(META_CACHE_PATH):
+            # A stale cache beats failing hard on a network blip
             print(
-                f"Warning: Failed to fetch or process data for sensor {sensor_id}: {e}",
+                "Warning: Metadata API unreachable, falling back to stale cache.",
                 file=sys.stderr,
             )
-        except Exception as e_inner:
+            with open(META_CACHE_PATH, "rb") as cache_file:
+                return orjson.loads(cache_file.read())
+        raise
+
+    with open(META_CACHE_PATH, "wb") as cache_file:
+        cache_file.write(meta_response.content)
+    # Decode the raw bytes directly, same as the sensor-data path
+    return orjson.loads(meta_response.content)
+
+
+def run_initial_data_load(pool):
+    """Fetch all sensor data from the openSenseMap API and insert it into the database."""
+    print("--- Starting Initial Data Load ---")
+    conn_insert = None
+    try:
+        conn_insert = pool.getconn()  # pooled connection to timescaledb
+        cursor_insert = conn_insert.cursor()
+
+        # Session-local staging table for COPY-based ingest. COPY streams rows
+        # over the CSV protocol and bypasses per-row parse/bind entirely, which
+        # is considerably faster than even batched INSERT statements.
+        cursor_insert.execute(
+            "CREATE TEMP TABLE staging (LIKE sensor_data) ON COMMIT PRESERVE ROWS;"
+        )
+        # Prepare the staging flush once so the per-sensor executions reuse the
+        # same parsed plan instead of re-parsing the statement every time
+        cursor_insert.execute(
+            """
+            PREPARE flush_staging AS
+            INSERT INTO sensor_data
+            SELECT * FROM staging
+            ON CONFLICT (timestamp, box_id, sensor_id) DO NOTHING;
+            """
+        )
+
+        # 1. Fetch Metadata (from cache if fresh enough)
+        metadata = load_metadata()
+
+        if not metadata or "sensors" not in metadata:
             print(
-                f"Warning: An unexpected error occurred processing sensor {sensor_id}: {e_inner}",
+                "Error: Could not retrieve valid metadata or no sensors found.",
                 file=sys.stderr,
             )
+            return
+
+        # Store sensor metadata (type, unit, icon) by sensor_id
+        sensor_details = {
+            s["_id"]: {
+                "type": s.get("sensorType", "unknown"),
+                "unit": s.get("unit", ""),
+            }
+            for s in metadata["sensors"]
+            if "_id" in s
+        }
+
+        # 2. Fetch, Validate and Insert Data for All Sensors
+        # The fetches are network-latency-bound, so running them in a thread pool
+        # over a keep-alive Session (pooled connections, no TLS handshake per
+        # request) gives near-linear speedup with the number of sensors.
+        # Producers hand validated row batches to this thread over a bounded
+        # queue, so DB flushes overlap with the still-running HTTP fetches
+        # instead of waiting for all of them to finish.
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+        batch_queue = queue.Queue(maxsize=4)
+
+        def fetch_and_validate(sensor_id, details):
+            """Producer: fetch one sensor's payload, validate it, enqueue rows.
+
+            Always enqueues exactly one (sensor_id, rows) item, so the
+            consumer below can simply count sensors instead of needing a
+            close sentinel.
+            """
+            data_to_insert = []
+            try:
+                print(
+                    f"Fetching data for Sensor ID: {sensor_id} (Type: {details['type']})"
+                )
+                data_url = SENSOR_DATA_API_URL_FORMAT.format(
+                    sensebox_id=SENSEBOX_ID,
+                    sensor_id=sensor_id,
+                )
+                data_response = session.get(data_url, timeout=60)
+                data_response.raise_for_status()
+                # orjson parses the raw bytes in a single C call, noticeably
+                # faster and with less allocation churn than response.json()
+                # (stdlib json) for the large lists of measurement dicts
+                # this endpoint returns
+                sensor_data = orjson.loads(data_response.content)
+
+                if sensor_data:  # Check if list is not empty
+                    # Prepare data for insertion. One comprehension keeps only
+                    # items with the essential fields; np.array then parses the
+                    # value strings to float64 in a single C loop (the "nan"
+                    # stand-in for missing values parses to NaN there too), so
+                    # no Python-level float() call runs per item. Non-finite
+                    # values are masked out below.
+                    raw = [
+                        (item["createdAt"], item["value"])
+                        for item in sensor_data
+                        if "createdAt" in item and "value" in item
+                    ]
+                    values = np.array(
+                        ["nan" if v is None else v for _, v in raw],
+                        dtype=np.float64,
+                    )
+                    finite = np.isfinite(values)
+                    data_to_insert = [
+                        (
+                            created_at,  # timestamp (TIMESTAMPTZ)
+                            SENSEBOX_ID,  # box_id (TEXT)
+                            sensor_id,  # sensor_id (TEXT)
+                            value,  # measurement (DOUBLE PRECISION)
+                            details["unit"],  # unit (TEXT)
+                            details["type"],  # sensor_type (TEXT)
+                        )
+                        for (created_at, _), value, keep in zip(raw, values, finite)
+                        if keep
+                    ]
+                    if not data_to_insert:
+                        print(
+                            f"No valid data points found to insert for sensor {sensor_id}."
+                        )
+                else:
+                    print(f"No data returned from API for sensor {sensor_id}.")
 
-    print("--- Initial Data Load Complete ---")
-
-except requests.exceptions.RequestException as e:
-    print(f"Error during initial data load (API request failed): {e}", file=sys.stderr)
-    sys.exit(1)
-except psycopg2.Error as db_err:
-    print(f"Error during initial data load (Database error): {db_err}", file=sys.stderr)
-    sys.exit(1)
-except Exception as e:
-    print(
-        f"An unexpected error occurred during initial data load: {e}", file=sys.stderr
+            except requests.exceptions.RequestException as e:
+                print(
+                    f"Warning: Failed to fetch or process data for sensor {sensor_id}: {e}",
+                    file=sys.stderr,
+                )
+            except Exception as e_inner:
+                print(
+                    f"Warning: An unexpected error occurred processing sensor {sensor_id}: {e_inner}",
+                    file=sys.stderr,
+                )
+            batch_queue.put((sensor_id, data_to_insert))
+
+        # This thread is the single consumer/DB writer: drain one batch per
+        # sensor and flush it while the remaining fetches are still in flight.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            for sensor_id, details in sensor_details.items():
+                executor.submit(fetch_and_validate, sensor_id, details)
+
+            consumed = 0
+            try:
+                for _ in range(len(sensor_details)):
+                    sensor_id, data_to_insert = batch_queue.get()
+                    consumed += 1
+                    if not data_to_insert:
+                        continue  # Nothing to insert, reason already printed above
+
+                    # Stream the rows into the staging table via COPY, then
+                    # move them into sensor_data in one statement, ignoring
+                    # conflicts (based on UNIQUE constraint in init.sql).
+                    # csv.writer emits None as an unquoted empty field, which
+                    # COPY ... WITH CSV reads back as NULL.
+                    # The whole ingest runs in one transaction (a single
+                    # commit, so a single WAL fsync); a savepoint around
+                    # each sensor's flush keeps one bad batch from
+                    # aborting the transaction for the remaining sensors.
+                    buf = io.StringIO()
+                    csv.writer(buf).writerows(data_to_insert)
+                    buf.seek(0)
+                    cursor_insert.execute("SAVEPOINT sensor_flush;")
+                    try:
+                        cursor_insert.copy_expert(
+                            "COPY staging (timestamp, box_id, sensor_id, measurement, unit, sensor_type) "
+                            "FROM STDIN WITH CSV",
+                            buf,
+                        )
+                        cursor_insert.execute(
+                            "EXECUTE flush_staging; TRUNCATE staging;"
+                        )
+                    except psycopg2.Error as flush_err:
+                        cursor_insert.execute("ROLLBACK TO SAVEPOINT sensor_flush;")
+                        print(
+                            f"Warning: Failed to insert records for sensor {sensor_id}: {flush_err}",
+                            file=sys.stderr,
+                        )
+                    else:
+                        cursor_insert.execute("RELEASE SAVEPOINT sensor_flush;")
+                        print(
+                            f"Inserted {len(data_to_insert)} records for sensor {sensor_id}."
+                        )
+            finally:
+                # If the flush loop dies anyway (e.g. the connection drops, so
+                # even the savepoint rollback fails), drain the batches still
+                # owed by the producers: each worker enqueues exactly one item,
+                # and with the queue bounded they would otherwise block in
+                # put() forever and the executor shutdown would never finish.
+                # With the queue drained the exception reaches the handlers
+                # below instead of hanging the bootstrap thread.
+                for _ in range(len(sensor_details) - consumed):
+                    batch_queue.get()
+
+        # Commit once after all sensors are processed instead of per sensor,
+        # so the WAL fsync cost is paid a single time
+        conn_insert.commit()
+        print("--- Initial Data Load Complete ---")
+
+    except requests.exceptions.RequestException as e:
+        print(
+            f"Error during initial data load (API request failed): {e}",
+            file=sys.stderr,
+        )
+    except psycopg2.Error as db_err:
+        print(
+            f"Error during initial data load (Database error): {db_err}",
+            file=sys.stderr,
+        )
+    except Exception as e:
+        print(
+            f"An unexpected error occurred during initial data load: {e}",
+            file=sys.stderr,
+        )
+    finally:
+        if conn_insert:
+            cursor_insert.close()
+            pool.putconn(conn_insert)
+            print("Database connection (insert) returned to pool.")
+
+
+def fetch_dashboard_frame(pool):
+    """Read the stored measurements back into a DataFrame for plotting."""
+    conn_read = None
+    df_all_sensors = pd.DataFrame()  # Initialize empty DataFrame
+    try:
+        conn_read = pool.getconn()
+        print(f"Fetching data from database for dashboard (Box ID: {SENSEBOX_ID})")
+        # Fetch relevant columns needed for plotting
+        # Downsample to per-minute averages server-side: the plots are only
+        # ~1-2k pixels wide, so shipping every raw row just to overplot it
+        # wastes bandwidth and DataFrame memory. AVG skips NULLs, and the
+        # remaining IS NOT NULL filter drops buckets that would otherwise be
+        # all-NULL. Values arrive as float and tz-aware datetime via
+        # psycopg2's default typecasters, so no pandas coercion pass is needed.
+        # Order by timestamp only: the faceted plot partitions by sensor_id
+        # itself while preserving input order within each sensor, so the
+        # extra sensor_type/sensor_id sort keys were wasted work in Postgres.
+        query = """
+            SELECT date_trunc('minute', timestamp) AS timestamp,
+                   avg(measurement) AS measurement,
+                   sensor_id, sensor_type, unit
+            FROM sensor_data
+            WHERE box_id = %s AND measurement IS NOT NULL
+            GROUP BY 1, 3, 4, 5
+            ORDER BY 1;
+            """
+        # Stream rows through a server-side (named) cursor and build the frame
+        # directly from the record tuples. pd.read_sql_query would fetch the
+        # whole result client-side first and go through its slower row
+        # adaptation layer, roughly doubling peak memory.
+        cursor_read = conn_read.cursor(name="dash_stream")
+        cursor_read.itersize = 10000
+        cursor_read.execute(query, (SENSEBOX_ID,))
+        df_all_sensors = pd.DataFrame.from_records(
+            cursor_read.fetchall(),
+            columns=["timestamp", "measurement", "sensor_id", "sensor_type", "unit"],
+        )
+        cursor_read.close()
+        # sensor_id, sensor_type and unit repeat for every row of a sensor;
+        # category dtype stores each distinct string once plus small integer
+        # codes, shrinking the frame and speeding up the faceted plot below.
+        for col in ("sensor_id", "sensor_type", "unit"):
+            df_all_sensors[col] = df_all_sensors[col].astype("category")
+        # float32 is plenty for sensor resolution and roughly halves the JSON
+        # payload Plotly serializes for the browser
+        df_all_sensors["measurement"] = df_all_sensors["measurement"].astype(
+            np.float32
+        )
+        print(f"Fetched {len(df_all_sensors)} records from database for dashboard.")
+
+    except psycopg2.Error as db_err:
+        print(f"Error fetching data for dashboard: {db_err}", file=sys.stderr)
+        # Keep df_all_sensors as empty
+    except Exception as e:
+        print(f"Error fetching data for dashboard: {e}", file=sys.stderr)
+        # Keep df_all_sensors as empty
+    finally:
+        if conn_read:
+            pool.putconn(conn_read)
+            print("Database connection (read) returned to pool.")
+    return df_all_sensors
+
+
+def build_graphs(df_all_sensors):
+    """Build the dashboard graph components from the sensor DataFrame."""
+    if df_all_sensors.empty:
+        print(
+            "No data retrieved from database or data is empty after cleaning. No graphs will be displayed."
+        )
+        return []
+
+    # Build one faceted figure (one row per sensor) instead of a separate
+    # px.line + dcc.Graph per sensor: a single trace-assembly pass, one
+    # JSON payload to the browser and one Plotly.js instance instead of
+    # many. render_mode='webgl' uses Scattergl so points render on the GPU.
+    print(f"Generating graphs for sensors: {df_all_sensors['sensor_id'].unique()}")
+
+    fig = px.line(
+        df_all_sensors,
+        x="timestamp",
+        y="measurement",
+        facet_row="sensor_id",
+        color="sensor_type",
+        render_mode="webgl",
+        labels={"timestamp": "Time", "measurement": "Measurement"},
+    )
+    # Sensors measure different quantities, so give every facet its own
+    # y-axis scale instead of a shared one
+    fig.update_yaxes(matches=None)
+    fig.update_layout(
+        height=max(400, 250 * df_all_sensors["sensor_id"].nunique()),
+        margin=dict(l=20, r=20, t=40, b=20),
     )
-    sys.exit(1)
-finally:
-    if conn_insert:
-        cursor_insert.close()
-        conn_insert.close()
-        print("Database connection (insert) closed.")
-
-
-# --- Prepare Data for Dashboard ---
-conn_read = None
-df_all_sensors = pd.DataFrame()  # Initialize empty DataFrame
-try:
-    conn_read = psycopg2.connect(DATABASE_URL)
-    print(f"Fetching data from database for dashboard (Box ID: {SENSEBOX_ID})")
-    # Fetch relevant columns needed for plotting
-    query = """
-        SELECT timestamp, measurement, sensor_id, sensor_type, unit
-        FROM sensor_data
-        WHERE box_id = %s
-        ORDER BY sensor_type, sensor_id, timestamp;
-        """
-    df_all_sensors = pd.read_sql_query(query, conn_read, params=(SENSEBOX_ID,))
-    print(f"Fetched {len(df_all_sensors)} records from database for dashboard.")
-
-except psycopg2.Error as db_err:
-    print(f"Error fetching data for dashboard: {db_err}", file=sys.stderr)
-    # Keep df_all_sensors as empty
-except Exception as e:
-    print(f"Error fetching data for dashboard: {e}", file=sys.stderr)
-    # Keep df_all_sensors as empty
-finally:
-    if conn_read:
-        conn_read.close()
-        print("Database connection (read) closed.")
+    return [dcc.Graph(figure=fig)]
+
+
+def bootstrap():
+    """Run ingest and graph building in the background so the server starts immediately."""
+    global READY, graphs
+    pool = None
+    try:
+        # One pool shared by the ingest and read phases, so the TCP + auth
+        # handshake is paid once instead of per phase. Built here rather
+        # than at import to keep server startup independent of the database.
+        pool = ThreadedConnectionPool(1, 4, DATABASE_URL)
+        run_initial_data_load(pool)
+        graphs = build_graphs(fetch_dashboard_frame(pool))
+    except Exception as e:
+        print(f"Error during background bootstrap: {e}", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.closeall()
+        READY = True
+
 
 # --- Create Dash App and Layout ---
 app = dash.Dash(__name__)
 app.title = f"SenseBox Dashboard: {SENSEBOX_ID}"
 
-graphs = []
-if not df_all_sensors.empty:
-    # Ensure 'measurement' is numeric, converting errors to NaN
-    df_all_sensors["measurement"] = pd.to_numeric(
-        df_all_sensors["measurement"], errors="coerce"
-    )
-    # Remove rows where conversion failed (measurement is NaN) or timestamp is invalid
-    df_all_sensors.dropna(subset=["measurement", "timestamp"], inplace=True)
-    # Convert timestamp column to datetime objects for Plotly
-    df_all_sensors["timestamp"] = pd.to_datetime(df_all_sensors["timestamp"])
-
-    # Generate a graph for each unique sensor_id
-    unique_sensor_ids = df_all_sensors["sensor_id"].unique()
-    print(f"Generating graphs for sensors: {unique_sensor_ids}")
-
-    for sensor_id in unique_sensor_ids:
-        df_sensor = df_all_sensors[df_all_sensors["sensor_id"] == sensor_id]
-        if not df_sensor.empty:
-            # Get sensor type and unit from the first row (should be same for all rows of this sensor_id)
-            sensor_type = df_sensor["sensor_type"].iloc[0]
-            unit = df_sensor["unit"].iloc[0]
-            graph_title = f"Type: {sensor_type} (ID: {sensor_id})"
-            yaxis_title = f"{sensor_type} ({unit})" if unit else sensor_type
-
-            fig = px.line(
-                df_sensor,
-                x="timestamp",
-                y="measurement",
-                title=graph_title,
-                labels={"timestamp": "Time", "measurement": yaxis_title},
-            )
-            fig.update_layout(margin=dict(l=20, r=20, t=40, b=20))
-            graphs.append(dcc.Graph(figure=fig))
-        else:
-            print(f"No plottable data found for sensor {sensor_id} after cleaning.")
-else:
-    print(
-        "No data retrieved from database or data is empty after cleaning. No graphs will be displayed."
-    )
-
-# --- App Layout ---
+# The layout renders immediately with a placeholder; the interval polls the
+# READY flag and swaps in the graphs once the bootstrap thread is done
 app.layout = html.Div(
     children=[
         html.H1(children=f"SenseBox Data Dashboard (ID: {SENSEBOX_ID})"),
         html.Hr(),
-        # Display graphs if any were generated, otherwise show a message
+        dcc.Interval(id="readiness-poll", interval=1000),
         html.Div(
-            children=(
-                graphs if graphs else html.P("No data available to display graphs.")
-            )
+            id="dashboard-content",
+            children=html.P("Loading sensor data..."),
         ),
     ]
 )
 
+
+@app.callback(
+    Output("dashboard-content", "children"),
+    Output("readiness-poll", "disabled"),
+    Input("readiness-poll", "n_intervals"),
+)
+def render_dashboard(_n_intervals):
+    if not READY:
+        return html.P("Loading sensor data..."), False
+    # Display graphs if any were generated, otherwise show a message;
+    # disable the interval so the browser stops polling
+    return (graphs if graphs else html.P("No data available to display graphs.")), True
+
+
+# Kick off ingest + dashboard prep without blocking module import, so the
+# HTTP server can serve readiness probes during the load window
+threading.Thread(target=bootstrap, daemon=True).start()
+
 # --- Run the App ---
 if __name__ == "__main__":
     # Use host='0.0.0.0' to make it accessible outside the container
@@ -19,4 +19,12 @@ SELECT create_hypertable('sensor_data', 'timestamp', if_not_exists => TRUE);
 
 -- Optional: Add indexes for faster queries
 CREATE INDEX IF NOT EXISTS idx_sensor_data_box_id_ts ON sensor_data (box_id, timestamp DESC);
-CREATE INDEX IF NOT EXISTS idx_sensor_data_sensor_id_ts ON sensor_data (sensor_id, timestamp DESC);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_sensor_data_sensor_id_ts ON sensor_data (sensor_id, timestamp DESC);
+
+-- Covering index for the dashboard read: the leading box_id matches the
+-- query's filter and the remaining key plus INCLUDEd columns supply every
+-- column the minute-bucket aggregation touches, so it can run as an
+-- index-only scan with rows already clustered per sensor for grouping
+CREATE INDEX IF NOT EXISTS idx_sensor_data_box_sort
+    ON sensor_data (box_id, sensor_type, sensor_id, timestamp)
+    INCLUDE (measurement, unit);
\ No newline at end of file